@@ -1,19 +1,48 @@
-from flask import Flask, render_template_string, request, jsonify, Response
+from flask import Flask, request, jsonify, Response
 import os
+import gzip
+import hashlib
 import re
+import heapq
 from collections import Counter
+from functools import lru_cache
+from itertools import chain
 import math
+import time
+import threading
 
 app = Flask(__name__)
 
 # API Key - with fallback for testing
 GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
 
+# Seconds an idle Groq connection stays open for reuse (httpx default is 5)
+GROQ_KEEPALIVE_SECONDS = 120
+
+def warm_groq_connection():
+    """Open the pooled Groq HTTPS connection before the first chat needs it"""
+    try:
+        client.models.list()
+    except Exception as e:
+        print(f"Error warming Groq connection: {e}")
+
 # Only import and initialize Groq if key is available
 if GROQ_API_KEY:
     try:
-        from groq import Groq
-        client = Groq(api_key=GROQ_API_KEY)
+        import httpx
+        from groq import Groq, DefaultHttpxClient
+        # Keep idle connections long enough that chats minutes apart skip the TLS handshake
+        client = Groq(
+            api_key=GROQ_API_KEY,
+            http_client=DefaultHttpxClient(limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=GROQ_KEEPALIVE_SECONDS,
+            )),
+        )
+        # Open a pooled connection while the page loads; with the longer keep-alive
+        # it is still idle in the pool when the user sends their first question
+        threading.Thread(target=warm_groq_connection, daemon=True).start()
     except Exception as e:
         print(f"Error initializing Groq: {e}")
         client = None
@@ -57,99 +86,140 @@ Critical Periods
 
 Activity-dependent refinement happens at particular times during development. Torsten Wiesel and David Hubel discovered that a brief period of visual deprivation during development forever altered neural circuits in the visual cortex."""
 
-# Split text into chunks
-chunks = [chunk.strip() for chunk in neuroscience_text.split('\n\n') if chunk.strip()]
+# Split text into chunks on blank lines (including whitespace-only ones)
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+chunks = [chunk for chunk in map(str.strip, PARAGRAPH_BREAK.split(neuroscience_text)) if chunk]
+
+# Approximate LLM token count per chunk (~4 characters per token)
+chunk_tokens = [len(chunk) // 4 for chunk in chunks]
+
+# Maximum context tokens sent to the LLM per question
+CONTEXT_TOKEN_BUDGET = 1024
 
 # Simple tokenizer
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Function words and question words that carry no topic
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'by', 'do', 'does', 'for', 'how', 'in', 'is',
+    'it', 'of', 'on', 'that', 'the', 'this', 'to', 'what', 'when', 'which', 'why', 'with',
+})
+
 def tokenize(text):
-    """Convert text to lowercase tokens"""
-    return re.findall(r'\w+', text.lower())
+    """Convert text to lowercase tokens, dropping stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
 
 # Build simple TF-IDF index
 def compute_tf(tokens):
-    """Compute term frequency"""
-    if not tokens:
-        return {}
-    counter = Counter(tokens)
-    total = len(tokens)
-    return {word: count / total for word, count in counter.items()}
+    """Compute raw term counts"""
+    # No division by len(tokens): vectors are L2-normalized afterwards,
+    # which cancels any constant per-text scale
+    return Counter(tokens)
 
 def compute_idf(chunks):
     """Compute inverse document frequency"""
     doc_count = len(chunks)
-    word_doc_count = {}
-    
-    for chunk in chunks:
-        words = set(tokenize(chunk))
-        for word in words:
-            word_doc_count[word] = word_doc_count.get(word, 0) + 1
+    word_doc_count = Counter(chain.from_iterable(set(tokenize(chunk)) for chunk in chunks))
     
-    return {word: math.log(doc_count / count) for word, count in word_doc_count.items()}
-
-# Precompute TF-IDF for all chunks
-try:
-    print("Building search index...")
-    idf = compute_idf(chunks)
-    chunk_vectors = []
-    for chunk in chunks:
-        tokens = tokenize(chunk)
-        tf = compute_tf(tokens)
-        tfidf = {word: tf[word] * idf.get(word, 0) for word in tf}
-        chunk_vectors.append(tfidf)
-    print(f"Indexed {len(chunks)} text chunks")
-except Exception as e:
-    print(f"Error building index: {e}")
-    chunk_vectors = []
-
-def cosine_similarity_tfidf(vec1, vec2):
-    """Calculate cosine similarity between TF-IDF vectors"""
+    # Words found in all, or all but one, chunks (idf <= log(N / (N - 1)))
+    # barely discriminate, so leave them out; tiny corpora keep the latter
+    max_count = doc_count - 1 if doc_count > 2 else doc_count
+    return {word: math.log(doc_count / count) for word, count in word_doc_count.items() if count < max_count}
+
+def tfidf_vector(tokens, idf):
+    """Compute the L2-normalized TF-IDF vector for a list of tokens"""
+    tf = compute_tf(tokens)
+    # Words outside the vocabulary have no IDF weight, so leave them out
+    vec = {word: freq * idf[word] for word, freq in tf.items() if word in idf}
+    # Scale in place rather than building a second dict
+    mag = math.sqrt(sum(v * v for v in vec.values()))
+    if mag:
+        for word in vec:
+            vec[word] /= mag
+    return vec
+
+# TF-IDF index for all chunks, built on first use rather than at import
+@lru_cache(maxsize=1)
+def get_index():
+    """Build the TF-IDF index once and return (idf, chunk_vectors, term_index)"""
     try:
-        # Get common words
-        common = set(vec1.keys()) & set(vec2.keys())
+        print("Building search index...")
+        idf = compute_idf(chunks)
+        chunk_vectors = [tfidf_vector(tokenize(chunk), idf) for chunk in chunks]
         
-        if not common:
-            return 0.0
-        
-        # Dot product
-        dot = sum(vec1[w] * vec2[w] for w in common)
-        
-        # Magnitudes
-        mag1 = math.sqrt(sum(v * v for v in vec1.values()))
-        mag2 = math.sqrt(sum(v * v for v in vec2.values()))
-        
-        if mag1 == 0 or mag2 == 0:
-            return 0.0
-        
-        return dot / (mag1 * mag2)
+        # Same sparse matrix stored by term: word -> [(chunk index, weight), ...]
+        term_index = {}
+        for i, chunk_vec in enumerate(chunk_vectors):
+            for word, weight in chunk_vec.items():
+                term_index.setdefault(word, []).append((i, weight))
+        print(f"Indexed {len(chunks)} text chunks")
+        return idf, chunk_vectors, term_index
     except Exception as e:
-        print(f"Error in similarity: {e}")
-        return 0.0
+        # Not cached, so the next request retries the build
+        print(f"Error building index: {e}")
+        raise
+
+@lru_cache(maxsize=512)
+def rank_chunks(query_tokens, top_k):
+    """Join the top k chunks for a tokenized question (memoized)"""
+    idf, _, term_index = get_index()
+    
+    # Off-topic questions share no words with the knowledge base; skip scoring
+    if not any(word in idf for word in query_tokens):
+        return ""
+    
+    query_tfidf = tfidf_vector(query_tokens, idf)
+    
+    # Sparse matrix-vector product over the query terms' postings, so only
+    # chunks sharing a word with the question get a score. Vectors are
+    # pre-normalized, so each dot product is the cosine similarity.
+    similarities = {}
+    for word, weight in query_tfidf.items():
+        for i, chunk_weight in term_index[word]:
+            similarities[i] = similarities.get(i, 0.0) + weight * chunk_weight
+    
+    # Get top k candidates without sorting every chunk (ties keep text order)
+    top_indices = heapq.nlargest(top_k, similarities, key=lambda i: (similarities[i], -i))
+    
+    # Pack the best chunks into the token budget; the top chunk always goes in
+    relevant_chunks = []
+    used_tokens = 0
+    for i in top_indices:
+        if relevant_chunks and used_tokens + chunk_tokens[i] > CONTEXT_TOKEN_BUDGET:
+            continue
+        relevant_chunks.append(chunks[i])
+        used_tokens += chunk_tokens[i]
+    return "\n\n".join(relevant_chunks)
 
 def find_relevant_context(question, top_k=3):
     """Find most relevant text chunks for the question"""
     try:
-        # Compute TF-IDF for query
-        query_tokens = tokenize(question)
-        query_tf = compute_tf(query_tokens)
-        query_tfidf = {word: query_tf[word] * idf.get(word, 0) for word in query_tf}
-        
-        # Calculate similarities
-        similarities = []
-        for chunk_vec in chunk_vectors:
-            sim = cosine_similarity_tfidf(query_tfidf, chunk_vec)
-            similarities.append(sim)
-        
-        # Get top k indices
-        indexed_sims = list(enumerate(similarities))
-        indexed_sims.sort(key=lambda x: x[1], reverse=True)
-        top_indices = [idx for idx, _ in indexed_sims[:top_k]]
-        
-        relevant_chunks = [chunks[i] for i in top_indices]
-        return "\n\n".join(relevant_chunks)
+        # TF-IDF ignores case, punctuation and word order, so questions
+        # with the same bag of words share one cache entry
+        query_tokens = tuple(sorted(tokenize(question)))
+        return rank_chunks(query_tokens, top_k)
     except Exception as e:
         print(f"Error finding context: {e}")
         return neuroscience_text[:1000]  # Fallback to first 1000 chars
 
+# Fixed instruction block that opens every prompt
+PROMPT_PREAMBLE = """Based on the following neuroscience information, answer the question.
+
+Context:
+"""
+
+# Opening used instead when no chunk matched the question
+PROMPT_NO_CONTEXT = "Answer the following question about neuroscience."
+
+# Fixed text around the question that closes every prompt
+PROMPT_QUESTION = "\n\nQuestion: "
+PROMPT_ANSWER = "\n\nAnswer:"
+
+# Streamed answers are flushed once this many characters are buffered
+# or this many seconds have passed since the last flush
+STREAM_FLUSH_CHARS = 256
+STREAM_FLUSH_INTERVAL = 0.02
+
 # HTML Template
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -404,9 +474,24 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# The page only depends on GROQ_API_KEY, which is fixed for the life of the
+# process, so render and compress it once instead of on every request
+HTML_PAGE = app.jinja_env.from_string(HTML_TEMPLATE).render(api_key_set=bool(GROQ_API_KEY)).encode('utf-8')
+HTML_PAGE_GZIP = gzip.compress(HTML_PAGE, 6)
+HTML_ETAG = hashlib.sha256(HTML_PAGE).hexdigest()
+
 @app.route('/')
 def home():
-    return render_template_string(HTML_TEMPLATE, api_key_set=bool(GROQ_API_KEY))
+    if request.accept_encodings['gzip']:
+        response = Response(HTML_PAGE_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(HTML_ETAG + '-gzip')
+    else:
+        response = Response(HTML_PAGE, mimetype='text/html')
+        response.set_etag(HTML_ETAG)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response.make_conditional(request)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -421,19 +506,16 @@ def chat():
             return Response("Error: GROQ_API_KEY environment variable not set. Please configure it in Vercel settings.", mimetype='text/plain')
         
         def generate():
+            buf = ''
             try:
                 # Get relevant context using TF-IDF
                 context = find_relevant_context(question)
                 
-                # Create prompt
-                prompt = f"""Based on the following neuroscience information, answer the question.
-
-Context:
-{context}
-
-Question: {question}
-
-Answer:"""
+                # Create prompt, most stable text first
+                if context:
+                    prompt = "".join((PROMPT_PREAMBLE, context, PROMPT_QUESTION, question, PROMPT_ANSWER))
+                else:
+                    prompt = "".join((PROMPT_NO_CONTEXT, PROMPT_QUESTION, question, PROMPT_ANSWER))
                 
                 # Stream response from Groq
                 completion = client.chat.completions.create(
@@ -446,13 +528,23 @@ Answer:"""
                     stop=None
                 )
                 
+                # Coalesce tiny deltas so each HTTP chunk carries several tokens
+                last_flush = time.monotonic()
                 for chunk in completion:
-                    if chunk.choices[0].delta.content:
-                        yield chunk.choices[0].delta.content
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        buf += content
+                        if len(buf) >= STREAM_FLUSH_CHARS or time.monotonic() - last_flush > STREAM_FLUSH_INTERVAL:
+                            yield buf.encode('utf-8')
+                            buf = ''
+                            last_flush = time.monotonic()
+                if buf:
+                    yield buf.encode('utf-8')
             except Exception as e:
-                yield f"Error generating response: {str(e)}"
+                yield f"{buf}Error generating response: {str(e)}".encode('utf-8')
         
-        return Response(generate(), mimetype='text/plain')
+        # Chunks are already UTF-8 bytes, so Werkzeug can pass them straight through
+        return Response(generate(), mimetype='text/plain', direct_passthrough=True)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -462,9 +554,19 @@ def health():
         'status': 'ok',
         'api_key_set': bool(GROQ_API_KEY),
         'chunks_indexed': len(chunks),
-        'vectors_built': len(chunk_vectors)
+        # Report the index without building it on a cold worker
+        'vectors_built': len(get_index()[1]) if get_index.cache_info().currsize else 0
     })
 
+@app.route('/api/warm')
+def warm():
+    # Lets a cron or deploy hook build the index before the first real question
+    try:
+        get_index()
+        return '', 204
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/info')
 def info():
     return jsonify({
@@ -477,4 +579,7 @@ def info():
     })
 
 if __name__ == '__main__':
+    # Development server only. Outside Vercel, run under a threaded WSGI
+    # server so concurrent chats stream in parallel, e.g.:
+    #   gunicorn --chdir api -k gthread --threads 8 index:app
     app.run(debug=True)